@@ -3,7 +3,9 @@ from typing import Optional
 import arrow
 import click
 
+from core.batch import load_jobs, run_batch
 from core.tiles import *
+from core.utils.aoi import load_aoi
 
 common_options = [
     click.option(
@@ -29,6 +31,37 @@ common_options = [
     click.option("--radius", type=int, default=1000 * 50, help="Radius in meters"),
     click.option("--zoom", type=int, default=7, help="Map zoom level"),
     click.option("--output", type=str, default=None, help="Output file name"),
+    click.option(
+        "--workers", type=int, default=1, help="Worker processes for sharded mode"
+    ),
+    click.option("--tmp_dir", type=str, default=None, help="Tile work directory"),
+    click.option(
+        "--resume", is_flag=True, default=False, help="Skip tiles already downloaded"
+    ),
+    click.option(
+        "--mmap", is_flag=True, default=False, help="Memory-mapped .npy output"
+    ),
+    click.option(
+        "--aoi",
+        type=str,
+        default=None,
+        help='"circle" (center_latlng + radius) or a GeoJSON file',
+    ),
+    click.option(
+        "--mask", is_flag=True, default=False, help="Clear pixels outside the aoi"
+    ),
+    click.option(
+        "--target_size",
+        type=int,
+        default=None,
+        help="Output size in pixels, picks the zoom automatically",
+    ),
+    click.option(
+        "--target_resolution",
+        type=float,
+        default=None,
+        help="Ground resolution in meters/pixel, picks the zoom automatically",
+    ),
 ]
 
 
@@ -43,6 +76,22 @@ def add_options(options):
     return decorator
 
 
+def render(
+    tile: TileDownloader,
+    output: str,
+    tmp_dir: Optional[str],
+    workers: int,
+    resume: bool,
+    mmap: bool,
+):
+    """Write decoded values for .npy outputs, an image otherwise."""
+    if output.endswith(".npy"):
+        if workers > 1:
+            raise click.UsageError("--workers is not supported for .npy outputs")
+        return tile.to_npy(output, tmp_dir=tmp_dir, resume=resume, mmap=mmap)
+    return tile.to_png(output, tmp_dir=tmp_dir, workers=workers, resume=resume)
+
+
 @click.group()
 def cli():
     pass
@@ -81,6 +130,14 @@ def windy(
     radius: Optional[int] = 0,
     zoom: Optional[int] = 7,
     output: Optional[str] = None,
+    workers: int = 1,
+    tmp_dir: Optional[str] = None,
+    resume: bool = False,
+    mmap: bool = False,
+    aoi: Optional[str] = None,
+    mask: bool = False,
+    target_size: Optional[int] = None,
+    target_resolution: Optional[float] = None,
 ):
     if date is None:
         now = arrow.utcnow().shift(minutes=-15)
@@ -97,6 +154,10 @@ def windy(
             center_latlng=center_latlng,
             radius=radius,
             zoom=zoom,
+            aoi=load_aoi(aoi, center_latlng, radius),
+            mask=mask,
+            target_size=target_size,
+            target_resolution=target_resolution,
         )
     elif type == "vis":
         tile = WindySatelliteVisTileDownloader(
@@ -107,10 +168,14 @@ def windy(
             center_latlng=center_latlng,
             radius=radius,
             zoom=zoom,
+            aoi=load_aoi(aoi, center_latlng, radius),
+            mask=mask,
+            target_size=target_size,
+            target_resolution=target_resolution,
         )
     if output is None:
         output = f"windy_sate-{type}_{now.format('YYYYMMDDHHmmss')}.png"
-    tile.to_png(output)
+    render(tile, output, tmp_dir, workers, resume, mmap)
 
 
 @sate.command()
@@ -126,6 +191,14 @@ def rainviewer(
     radius: Optional[int] = 0,
     zoom: Optional[int] = 7,
     output: Optional[str] = None,
+    workers: int = 1,
+    tmp_dir: Optional[str] = None,
+    resume: bool = False,
+    mmap: bool = False,
+    aoi: Optional[str] = None,
+    mask: bool = False,
+    target_size: Optional[int] = None,
+    target_resolution: Optional[float] = None,
 ):
     if date is None:
         now = arrow.utcnow().shift(minutes=-15)
@@ -142,12 +215,16 @@ def rainviewer(
             center_latlng=center_latlng,
             radius=radius,
             zoom=zoom,
+            aoi=load_aoi(aoi, center_latlng, radius),
+            mask=mask,
+            target_size=target_size,
+            target_resolution=target_resolution,
         )
     else:
         raise ValueError(f"Invalid type: {type}")
     if output is None:
         output = f"rainviewer_sate-{type}_{now.format('YYYYMMDDHHmmss')}.png"
-    tile.to_png(output)
+    render(tile, output, tmp_dir, workers, resume, mmap)
 
 
 @radar.command()
@@ -161,6 +238,14 @@ def windy(
     radius: Optional[int] = 0,
     zoom: Optional[int] = 7,
     output: Optional[str] = None,
+    workers: int = 1,
+    tmp_dir: Optional[str] = None,
+    resume: bool = False,
+    mmap: bool = False,
+    aoi: Optional[str] = None,
+    mask: bool = False,
+    target_size: Optional[int] = None,
+    target_resolution: Optional[float] = None,
 ):
     if date is None:
         now = arrow.utcnow().shift(minutes=-5)
@@ -176,10 +261,14 @@ def windy(
         center_latlng=center_latlng,
         radius=radius,
         zoom=zoom,
+        aoi=load_aoi(aoi, center_latlng, radius),
+        mask=mask,
+        target_size=target_size,
+        target_resolution=target_resolution,
     )
     if output is None:
         output = f"windy_radar_{now.format('YYYYMMDDHHmmss')}.png"
-    tile.to_png(output)
+    render(tile, output, tmp_dir, workers, resume, mmap)
 
 
 @radar.command()
@@ -187,12 +276,25 @@ def windy(
 def rainviewer(
     lat_bounds: tuple[float, float],
     lon_bounds: tuple[float, float],
+    date: Optional[str] = None,
+    archive: bool = True,
     center_latlng: Optional[tuple[float, float]] = None,
     radius: Optional[int] = 0,
     zoom: Optional[int] = 7,
     output: Optional[str] = None,
+    workers: int = 1,
+    tmp_dir: Optional[str] = None,
+    resume: bool = False,
+    mmap: bool = False,
+    aoi: Optional[str] = None,
+    mask: bool = False,
+    target_size: Optional[int] = None,
+    target_resolution: Optional[float] = None,
 ):
-    now = arrow.utcnow().shift(minutes=-5)
+    if date is None:
+        now = arrow.utcnow().shift(minutes=-5)
+    else:
+        now = arrow.get(date)
     floored_minute = (now.minute // 10) * 10
     now = now.floor("minute").replace(minute=floored_minute)
     tile = RainViewerRadarV2TileDownloader(
@@ -202,10 +304,14 @@ def rainviewer(
         center_latlng=center_latlng,
         radius=radius,
         zoom=zoom,
+        aoi=load_aoi(aoi, center_latlng, radius),
+        mask=mask,
+        target_size=target_size,
+        target_resolution=target_resolution,
     )
     if output is None:
         output = f"rainviewer_radar_{now.format('YYYYMMDDHHmmss')}.png"
-    tile.to_png(output)
+    render(tile, output, tmp_dir, workers, resume, mmap)
 
 
 @map.command()
@@ -213,10 +319,20 @@ def rainviewer(
 def google(
     lat_bounds: tuple[float, float],
     lon_bounds: tuple[float, float],
+    date: Optional[str] = None,
+    archive: bool = True,
     center_latlng: Optional[tuple[float, float]] = None,
     radius: Optional[int] = 0,
     zoom: Optional[int] = 7,
     output: Optional[str] = None,
+    workers: int = 1,
+    tmp_dir: Optional[str] = None,
+    resume: bool = False,
+    mmap: bool = False,
+    aoi: Optional[str] = None,
+    mask: bool = False,
+    target_size: Optional[int] = None,
+    target_resolution: Optional[float] = None,
 ):
     tile = GoogleSatelliteMapTileDownloader(
         {},
@@ -225,38 +341,70 @@ def google(
         center_latlng=center_latlng,
         radius=radius,
         zoom=zoom,
+        aoi=load_aoi(aoi, center_latlng, radius),
+        mask=mask,
+        target_size=target_size,
+        target_resolution=target_resolution,
     )
     if output is None:
         output = "google_satellite_map.png"
-    tile.to_png(output)
+    render(tile, output, tmp_dir, workers, resume, mmap)
 
 
 @tile.command()
 @add_options(common_options)
-@click.option("--url_template", type=str, required=True)
+@click.option(
+    "--url_template",
+    type=str,
+    required=True,
+    help="http(s) or file:// template, {z}/{x}/{y} directory path, or .mbtiles file",
+)
 def tile(
     url_template: str,
     lat_bounds: tuple[float, float],
     lon_bounds: tuple[float, float],
+    date: Optional[str] = None,
+    archive: bool = True,
     center_latlng: Optional[tuple[float, float]] = None,
     radius: Optional[int] = 0,
     zoom: Optional[int] = 10,
     output: Optional[str] = None,
+    workers: int = 1,
+    tmp_dir: Optional[str] = None,
+    resume: bool = False,
+    mmap: bool = False,
+    aoi: Optional[str] = None,
+    mask: bool = False,
+    target_size: Optional[int] = None,
+    target_resolution: Optional[float] = None,
 ):
-    class UDFTTileDownloader(TileDownloader):
-        url_template = url_template
-
-    tile = UDFTTileDownloader(
+    tile = TemplateTileDownloader(
+        url_template,
         lat_bounds=lat_bounds,
         lon_bounds=lon_bounds,
         center_latlng=center_latlng,
         radius=radius,
         zoom=zoom,
+        aoi=load_aoi(aoi, center_latlng, radius),
+        mask=mask,
+        target_size=target_size,
+        target_resolution=target_resolution,
+        parse=False,
     )
-    tile.download()
     if output is None:
-        output = f"download_map-zoom{zoom}.webp"
-    tile.merge(output)
+        output = f"download_map-zoom{tile.zoom}.webp"
+    render(tile, output, tmp_dir, workers, resume, mmap)
+
+
+@cli.command()
+@click.argument("job_file", type=click.Path(exists=True))
+@click.option("--tmp_dir", type=str, default=None, help="Shared tile directory")
+def batch(job_file: str, tmp_dir: Optional[str] = None):
+    report = run_batch(load_jobs(job_file), tmp_dir=tmp_dir)
+    if report["failed"]:
+        raise click.ClickException(
+            f"{len(report['failed'])} job(s) failed: {', '.join(report['failed'])}"
+        )
 
 
 if __name__ == "__main__":
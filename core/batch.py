@@ -0,0 +1,206 @@
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import arrow
+
+from .tiles import (
+    GoogleSatelliteMapTileDownloader,
+    RainViewerRadarV2TileDownloader,
+    RainviewSatelliteInfraTileDownloader,
+    TileDownloader,
+    TileFile,
+    WindyRadarV2TileDownloader,
+    WindySatelliteInfraTileDownloader,
+    WindySatelliteVisTileDownloader,
+)
+from .utils.aoi import load_aoi
+
+__all__ = ["PRODUCTS", "BatchJob", "load_jobs", "run_batch"]
+
+
+def _floor_date(date: str | None, now: arrow.Arrow, shift: int, step: int):
+    if date is None:
+        date = now.shift(minutes=-shift)
+    else:
+        date = arrow.get(date)
+    floored_minute = (date.minute // step) * step
+    return date.floor("minute").replace(minute=floored_minute)
+
+
+def _windy_radar(date, now, archive, **kwargs):
+    date = _floor_date(date, now, 5, 5)
+    # no value parser, tiles are rendered as they are
+    return WindyRadarV2TileDownloader(date, archive=archive, parse=False, **kwargs)
+
+
+def _rainviewer_radar(date, now, archive, **kwargs):
+    date = _floor_date(date, now, 5, 10)
+    return RainViewerRadarV2TileDownloader(int(date.timestamp()), **kwargs)
+
+
+def _windy_sate_infra(date, now, archive, **kwargs):
+    date = _floor_date(date, now, 15, 10)
+    return WindySatelliteInfraTileDownloader(date, archive=archive, **kwargs)
+
+
+def _windy_sate_vis(date, now, archive, **kwargs):
+    date = _floor_date(date, now, 15, 10)
+    return WindySatelliteVisTileDownloader(date, archive=archive, **kwargs)
+
+
+def _rainviewer_sate_infra(date, now, archive, **kwargs):
+    date = _floor_date(date, now, 15, 10)
+    return RainviewSatelliteInfraTileDownloader(date, **kwargs)
+
+
+def _google_map(date, now, archive, **kwargs):
+    return GoogleSatelliteMapTileDownloader({}, parse=False, **kwargs)
+
+
+PRODUCTS = {
+    "radar/windy": _windy_radar,
+    "radar/rainviewer": _rainviewer_radar,
+    "sate/windy-infra": _windy_sate_infra,
+    "sate/windy-vis": _windy_sate_vis,
+    "sate/rainviewer-infra": _rainviewer_sate_infra,
+    "map/google": _google_map,
+}
+
+
+@dataclass
+class BatchJob:
+    product: str
+    output: str
+    zoom: int = 7
+    lat_bounds: list[float] = field(default_factory=lambda: [0, 0])
+    lon_bounds: list[float] = field(default_factory=lambda: [0, 0])
+    center_latlng: tuple[float, float] = None
+    radius: int = 1000 * 50
+    date: str = None
+    archive: bool = False
+    # "circle" (center_latlng + radius) or a GeoJSON file path
+    aoi: str = None
+    mask: bool = False
+    target_size: int = None
+    target_resolution: float = None
+
+    def build(self, now: arrow.Arrow) -> TileDownloader:
+        if self.product not in PRODUCTS:
+            raise ValueError(f"Invalid product: {self.product}")
+        return PRODUCTS[self.product](
+            self.date,
+            now,
+            self.archive,
+            lat_bounds=self.lat_bounds,
+            lon_bounds=self.lon_bounds,
+            center_latlng=self.center_latlng,
+            radius=self.radius,
+            zoom=self.zoom,
+            aoi=load_aoi(self.aoi, self.center_latlng, self.radius),
+            mask=self.mask,
+            target_size=self.target_size,
+            target_resolution=self.target_resolution,
+        )
+
+
+def load_jobs(job_file: str) -> list[BatchJob]:
+    """Read a JSON job file, either a list of jobs or {"jobs": [...]}."""
+    with open(job_file) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data["jobs"]
+    jobs = []
+    for i, item in enumerate(data):
+        item = dict(item)
+        if item.get("output") is None:
+            item["output"] = f"{item['product'].replace('/', '_')}_{i}.png"
+        jobs.append(BatchJob(**item))
+    return jobs
+
+
+def run_batch(jobs: list[BatchJob], tmp_dir: str = None) -> dict:
+    """
+    Render all jobs from a shared tile pool.
+
+    Jobs are grouped by tile source (url template and zoom); every unique
+    tile of a group is downloaded once and then reused by each job of the
+    group when its output is assembled. A failing group or job is reported
+    and skipped, the other jobs still run.
+    """
+    now = arrow.utcnow()
+    failed: dict[str, str] = {}
+    downloaders: list[TileDownloader | None] = []
+    for job in jobs:
+        try:
+            downloaders.append(job.build(now))
+        except Exception as e:
+            print(f"job {job.output} failed: {e!r}")
+            failed[job.output] = repr(e)
+            downloaders.append(None)
+
+    groups: dict[tuple[str, int], list[TileDownloader]] = {}
+    for d in downloaders:
+        if d is not None:
+            groups.setdefault((d.url_template, d.zoom), []).append(d)
+
+    if tmp_dir is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            return _run_groups(groups, jobs, downloaders, tmp_dir, failed)
+    return _run_groups(groups, jobs, downloaders, tmp_dir, failed)
+
+
+def _run_groups(groups, jobs, downloaders, tmp_dir, failed) -> dict:
+    requested, unique = 0, 0
+    skipped = set()
+    for i, group in enumerate(groups.values()):
+        pool: dict[str, TileFile] = {}
+        for d in group:
+            for t in d.tiles:
+                pool.setdefault(t.url, TileFile(url=t.url, tile=t.tile))
+            requested += len(d.tiles)
+        unique += len(pool)
+
+        folder = os.path.join(tmp_dir, str(i))
+        try:
+            group[0].download(folder, tiles=list(pool.values()))
+        except Exception as e:
+            print(f"group {group[0].url_template} failed: {e!r}")
+            skipped.update(id(d) for d in group)
+            continue
+        for d in group:
+            for t in d.tiles:
+                shared = pool[t.url]
+                t.file, t.sha256, t.blank = shared.file, shared.sha256, shared.blank
+
+    for job, d in zip(jobs, downloaders):
+        if d is None:
+            continue
+        if id(d) in skipped:
+            failed[job.output] = "download failed"
+            continue
+        try:
+            Path(job.output).parent.mkdir(parents=True, exist_ok=True)
+            d.merge(job.output)
+        except Exception as e:
+            print(f"job {job.output} failed: {e!r}")
+            failed[job.output] = repr(e)
+
+    report = {
+        "jobs": len(jobs),
+        "groups": len(groups),
+        "requested_tiles": requested,
+        "unique_tiles": unique,
+        "dedup_ratio": requested / unique if unique else 1.0,
+        "failed": failed,
+    }
+    print(
+        f"requested tiles: {requested} unique tiles: {unique} "
+        f"dedup ratio: {report['dedup_ratio']:.2f}x "
+        f"saved: {requested - unique}"
+    )
+    if failed:
+        print(f"failed jobs: {len(failed)}/{len(jobs)}")
+    return report
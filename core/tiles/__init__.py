@@ -2,3 +2,4 @@ from .base import *
 from .map import *
 from .radar import *
 from .satellite import *
+from .source import *
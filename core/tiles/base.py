@@ -1,23 +1,30 @@
-import asyncio
+import hashlib
 import json
 import os
 import re
 import tempfile
+from collections import Counter
 from dataclasses import dataclass
 from pathlib import Path
 
 import arrow
-import httpx
+import numpy as np
 from PIL import Image
 from PIL.PngImagePlugin import PngInfo
 
-from ..config import header
-from ..utils.proj import crop_image, get_latlng, get_mymx
-from ..utils.xyz import GoogleXYZTile, Tile
+from ..utils.aoi import AOI
+from ..utils.proj import crop_box, crop_image, get_latlng, get_mymx
+from ..utils.xyz import GoogleXYZTile, Tile, select_zoom
+from .manifest import TileManifest
+from .shard import run_sharded
+from .source import TileSource, source_for_template
 
-max_concurrency = 10
-
-__all__ = ["TileDownloader", "TileFile", "WindyTileDownloader"]
+__all__ = [
+    "TemplateTileDownloader",
+    "TileDownloader",
+    "TileFile",
+    "WindyTileDownloader",
+]
 
 
 @dataclass
@@ -25,25 +32,42 @@ class TileFile:
     url: str
     tile: Tile
     file: Path = None
+    sha256: str = None
+    # fully transparent payload, kept as a manifest sentinel without a file
+    blank: bool = False
 
 
 class TileDownloader(object):
     output_format = "tile_{x}_{y}.{format}"
     url_template = None
     tilesize = 256
+    crop_size = (670, 670)
+    # codecs that Image.draft can decode at 1/2, 1/4 or 1/8 scale (JPEG DCT)
+    draft_formats = ("jpg",)
+    # sha256 of payloads known to be empty for a provider
+    blank_tile_hashes = frozenset()
+    min_zoom = 0
+    max_zoom = 18
 
     def __init__(
         self,
-        zoom: int,
+        zoom: int = None,
         lat_bounds: list[float] = [],
         lon_bounds: list[float] = [],
         center_latlng: tuple[float, float] = None,
         radius: int = 0,
         parse: bool = True,
         crop: bool = False,
+        aoi: AOI = None,
+        mask: bool = False,
+        target_size: int = None,
+        target_resolution: float = None,
+        source: TileSource = None,
         **kwargs,
     ):
-        if center_latlng:
+        if aoi is not None:
+            lat_bounds, lon_bounds = aoi.bounds()
+        elif center_latlng:
             center_lat, center_lon = center_latlng
             center_my, center_mx = get_mymx(center_lat, center_lon)
             top_left_latlng = get_latlng(center_my + radius, center_mx - radius)
@@ -56,20 +80,62 @@ class TileDownloader(object):
         right_bottom = (lat_bounds[0], lon_bounds[1])
         if self.url_template is None:
             raise NotImplementedError("url_template is not set")
+        self.source = source or source_for_template(self.url_template)
+        self.url_template = self.source.url_template(self.url_template)
         suffix = Path(self.url_template).suffix
         try:
             self.format = re.match(".(png|webp|jpg)?", suffix).group(1)
         except AttributeError:
             self.format = "png"
+        if self.source.format is not None:
+            self.format = self.source.format
+        if target_size is not None or target_resolution is not None:
+            zoom = select_zoom(
+                top_left[0],
+                top_left[1],
+                right_bottom[0],
+                right_bottom[1],
+                target_size=target_size,
+                target_resolution=target_resolution,
+                tilesize=self.tilesize,
+                min_zoom=self.min_zoom,
+                max_zoom=self.max_zoom,
+            )
+        if zoom is None:
+            raise ValueError("zoom or target_size/target_resolution is required")
+        if not self.min_zoom <= zoom <= self.max_zoom:
+            raise ValueError(
+                f"zoom {zoom} is outside {self.min_zoom}-{self.max_zoom} "
+                f"for {type(self).__name__}"
+            )
+        if target_size is not None:
+            # target_size is the size of the output, cropped to the bounds
+            crop = True
         self.zoom = zoom
         self.tile_xy = GoogleXYZTile(zoom=zoom)
         self.start_x, self.start_y, self.end_x, self.end_y = self.tile_xy.get_xy_range(
             top_left[0], top_left[1], right_bottom[0], right_bottom[1]
         )
+        self.aoi = aoi
+        self.mask = mask
+        # tiles touching the aoi, and tiles fully inside it that need no mask
+        self.aoi_cells, self.aoi_inside = None, None
+        if aoi is not None:
+            self.aoi_cells, self.aoi_inside = aoi.tile_grid(
+                self.tile_xy, self.start_x, self.start_y, self.end_x, self.end_y
+            )
         self.tiles = list(self.get_urls(top_left, right_bottom))
         self.len_y = self.end_y - self.start_y + 1
-        self.len_x = len(self.tiles) // self.len_y
+        self.len_x = self.end_x - self.start_x + 1
         self.crop = crop
+        if target_size is not None or target_resolution is not None:
+            print(f"zoom: {zoom} tiles: {len(self.tiles)}")
+        if aoi is not None:
+            rect_count = self.len_x * self.len_y
+            print(
+                f"aoi tiles: {len(self.tiles)} rectangle tiles: {rect_count} "
+                f"saved: {rect_count - len(self.tiles)}"
+            )
 
         top_left_latlng = self.tile_xy.get_tile_lat_lng(self.start_x, self.start_y)
         bottom_right_latlng = self.tile_xy.get_tile_lat_lng(
@@ -93,96 +159,191 @@ class TileDownloader(object):
         self.real_my_bounds = [bottom_right_mymx[0], top_left_mymx[0]]
         self.real_mx_bounds = [top_left_mymx[1], bottom_right_mymx[1]]
         print(self.real_my_bounds, self.real_mx_bounds)
+        if target_size is not None:
+            # keep the aspect ratio of the crop window, shorter side = target_size
+            width = self.real_mx_bounds[1] - self.real_mx_bounds[0]
+            height = self.real_my_bounds[1] - self.real_my_bounds[0]
+            scale = target_size / min(width, height)
+            self.crop_size = (round(width * scale), round(height * scale))
         self.success_count = 0
         self.parse = parse
         self.meta_info = {}
-        self.max_retries = 3
-        self.retry_delay = 1
         self.image = None
-        self.timeout = 20
-
-    def download(self, folder, **kwargs):
+        self.reduce = 1
+        self.blank_hashes = set(self.blank_tile_hashes)
+        self.manifest = None
+        self.blank_count = 0
+        self.dedup_count = 0
+
+    def download(
+        self, folder, tiles: list[TileFile] = None, resume: bool = False, **kwargs
+    ):
         if not os.path.exists(folder):
             os.makedirs(folder, exist_ok=True)
-
-        for t in self.tiles:
+        if tiles is None:
+            tiles = self.tiles
+        if self.manifest is None or self.manifest.path.parent != Path(folder):
+            self.manifest = TileManifest(folder)
+        self.blank_hashes |= self.manifest.blank_hashes()
+
+        pending = []
+        for t in tiles:
+            if resume and self.manifest.is_valid(t):
+                entry = self.manifest.entries[t.url]
+                t.file = Path(entry["file"])
+                t.sha256 = entry["sha256"]
+                t.blank = entry.get("blank", False)
+                self.success_count += 1
+                continue
             t.file = Path(folder) / self.output_format.format(
                 x=t.tile.x, y=t.tile.y, format=self.format
             )
+            pending.append(t)
+        if resume:
+            print(f"resume: skipped {len(tiles) - len(pending)} valid tiles")
 
-        results = asyncio.run(self._download_tiles_httpx(self.tiles))
-        for t in results:
+        self.source.fetch(pending, self._store_tile)
+        for t in pending:
             if t.file is not None:
                 self.success_count += 1
-        print(f"success_count: {self.success_count} total: {len(self.tiles)}")
-        return results
-
-    async def _download_tiles_httpx(self, tiles: list[TileFile]):
-        semaphore = asyncio.Semaphore(max_concurrency)
-        async with httpx.AsyncClient() as client:
-            tasks = [self._request_httpx(semaphore, client, t) for t in tiles]
-            await asyncio.gather(*tasks, return_exceptions=True)
+        print(f"success_count: {self.success_count} total: {len(tiles)}")
         return tiles
 
     def get_urls(
         self, top_left: tuple[float, float], right_bottom: tuple[float, float]
     ):
         for tile in self.tile_xy.iter_tile_xy(
-            top_left[0], top_left[1], right_bottom[0], right_bottom[1]
+            top_left[0],
+            top_left[1],
+            right_bottom[0],
+            right_bottom[1],
+            cells=self.aoi_cells,
         ):
             yield TileFile(url=self._get_url(tile.x, tile.y), tile=tile)
 
-    async def _request_httpx(
-        self, semaphore: asyncio.Semaphore, client: httpx.AsyncClient, t: TileFile
-    ) -> TileFile:
-        attempt = 0
-        while attempt < self.max_retries:
-            async with semaphore:
-                try:
-                    response = await client.get(
-                        t.url, headers=header, timeout=self.timeout
-                    )
-                    response.raise_for_status()
-                    with t.file.open("wb") as f:
-                        f.write(response.content)
-                    return t
-                except (
-                    httpx.HTTPStatusError,
-                    httpx.ConnectTimeout,
-                    httpx.ReadTimeout,
-                    httpx.ReadError,
-                ):
-                    attempt += 1
-                    await asyncio.sleep(self.retry_delay)
-        t.file = None
-        return t
+    def _store_tile(self, t: TileFile, content: bytes, path: Path = None):
+        t.sha256 = hashlib.sha256(content).hexdigest()
+        t.blank = t.sha256 in self.blank_hashes
+        if path is not None:
+            # local sources are used in place
+            t.file = path
+        elif not t.blank:
+            with t.file.open("wb") as f:
+                f.write(content)
+        self.manifest.record(t, content)
 
     def _get_url(self, x, y, **kwargs):
         return self.url_template.format(z=self.zoom, x=x, y=y, **kwargs)
 
-    def merge(self, filename) -> str:
-        merged_pic, metaInfo = self._merge_tiles()
+    def merge(self, filename, merged_pic: Image.Image = None) -> str:
+        merged_pic, metaInfo = self._merge_tiles(merged_pic)
         merged_pic.save(filename, pnginfo=metaInfo)
         print(filename)
         return filename
 
+    @property
+    def tile_px(self) -> int:
+        """Size of a pasted tile on the canvas after reduced decoding."""
+        return self.tilesize // self.reduce
+
+    def _decode_reduce(self) -> int:
+        """Largest DCT scale factor that still leaves the crop above crop_size."""
+        if not self.crop or self.format not in self.draft_formats:
+            return 1
+        left, top, right, bottom = self._array_window()
+        scale = min(
+            (right - left) / self.crop_size[0], (bottom - top) / self.crop_size[1]
+        )
+        for factor in (8, 4, 2):
+            if factor <= scale:
+                return factor
+        return 1
+
+    def _open_tile(self, tile: TileFile) -> Image.Image:
+        img = Image.open(tile.file)
+        if self.reduce > 1:
+            size = (img.width // self.reduce, img.height // self.reduce)
+            img.draft(img.mode, size)
+            if img.size != size:
+                # codec without draft support, e.g. a png behind a .jpg url
+                img = img.reduce(self.reduce)
+        return img
+
     def _process_single_tile(self, tile: TileFile) -> Image.Image:
-        return Image.open(tile.file)
+        return self._open_tile(tile)
 
     def _parse_value(self, merged_pic: Image.Image) -> Image.Image:
         raise NotImplementedError("Not implemented")
 
-    def _merge_tiles(self):
-        merged_pic = Image.new(
-            "RGBA", (self.len_x * self.tilesize, self.len_y * self.tilesize)
-        )
-
-        for i, tile in enumerate(self.tiles):
+    def _decode_value(self, data: np.ndarray) -> np.ndarray:
+        """Map RGBA pixels (..., 4) to numeric values, elementwise per pixel."""
+        return data
+
+    def _iter_tile_images(self, tiles: list[TileFile]):
+        """
+        Yield (tile, image) for tiles that need pasting.
+
+        Blank tiles are skipped without decoding once their hash is known,
+        and identical payloads are decoded once and reused.
+        """
+        self.blank_count, self.dedup_count = 0, 0
+        remaining = Counter(t.sha256 for t in tiles if t.sha256 is not None)
+        decoded = {}
+        for tile in tiles:
+            if tile.blank or tile.sha256 in self.blank_hashes:
+                self.blank_count += 1
+                continue
             if tile.file is None or not tile.file.exists():
                 continue
-            tile_img = self._process_single_tile(tile)
-            y, x = tile.tile.y - self.start_y, tile.tile.x - self.start_x
-            merged_pic.paste(tile_img, (x * self.tilesize, y * self.tilesize))
+            tile_img = decoded.get(tile.sha256)
+            if tile_img is not None:
+                self.dedup_count += 1
+            else:
+                tile_img = self._process_single_tile(tile)
+                if tile_img.mode == "RGBA" and not tile_img.getbbox(alpha_only=False):
+                    # same as the zeroed canvas, remember the payload as blank
+                    if tile.sha256 is not None:
+                        self.blank_hashes.add(tile.sha256)
+                    if self.manifest is not None:
+                        self.manifest.mark_blank(tile)
+                    self.blank_count += 1
+                    continue
+                if remaining[tile.sha256] > 1:
+                    decoded[tile.sha256] = tile_img
+            if tile.sha256 is not None:
+                remaining[tile.sha256] -= 1
+                if remaining[tile.sha256] == 0:
+                    decoded.pop(tile.sha256, None)
+            if self.mask and self.aoi is not None:
+                tile_img = self._mask_tile(tile, tile_img)
+            yield tile, tile_img
+
+    def _mask_tile(self, tile: TileFile, tile_img: Image.Image) -> Image.Image:
+        """Clear pixels of a tile that fall outside the aoi."""
+        if self.aoi_inside[tile.tile.y - self.start_y, tile.tile.x - self.start_x]:
+            return tile_img
+        bounds = self.tile_xy.get_tile_mercator_bounds(tile.tile.x, tile.tile.y)
+        tile_img = tile_img.convert("RGBA")
+        mask = self.aoi.mask(tile_img.size, *bounds)
+        return Image.composite(tile_img, Image.new("RGBA", tile_img.size), mask)
+
+    def _paste_tiles(
+        self, tiles: list[TileFile], start_x: int, start_y: int, len_x: int, len_y: int
+    ) -> Image.Image:
+        merged_pic = Image.new("RGBA", (len_x * self.tile_px, len_y * self.tile_px))
+
+        for tile, tile_img in self._iter_tile_images(tiles):
+            y, x = tile.tile.y - start_y, tile.tile.x - start_x
+            merged_pic.paste(tile_img, (x * self.tile_px, y * self.tile_px))
+        return merged_pic
+
+    def _merge_tiles(self, merged_pic: Image.Image = None):
+        if merged_pic is None:
+            self.reduce = self._decode_reduce()
+            merged_pic = self._paste_tiles(
+                self.tiles, self.start_x, self.start_y, self.len_x, self.len_y
+            )
+        print(f"blank tiles: {self.blank_count} deduplicated: {self.dedup_count}")
 
         if self.parse:
             merged_pic = self._parse_value(merged_pic)
@@ -194,6 +355,13 @@ class TileDownloader(object):
 
         self.image = merged_pic
 
+        self._update_meta()
+        pnginfo = PngInfo()
+        for k, v in self.meta_info.items():
+            pnginfo.add_text(k, json.dumps(v))
+        return merged_pic, pnginfo
+
+    def _update_meta(self):
         self.meta_info.update(
             {
                 "lat_bounds": self.real_lat_bounds,
@@ -204,19 +372,114 @@ class TileDownloader(object):
                 "mx_bounds": self.real_mx_bounds,
             }
         )
-        pnginfo = PngInfo()
-        for k, v in self.meta_info.items():
-            pnginfo.add_text(k, json.dumps(v))
-        return merged_pic, pnginfo
 
-    def to_png(self, output: str, tmp_dir: str = None) -> str | None:
+    def _array_window(self) -> tuple[int, int, int, int]:
+        size = (self.len_x * self.tilesize, self.len_y * self.tilesize)
+        if not self.crop:
+            return 0, 0, *size
+        left, top, right, bottom = crop_box(
+            size,
+            self.tile_my_bounds,
+            self.tile_mx_bounds,
+            self.real_my_bounds,
+            self.real_mx_bounds,
+        )
+        return max(left, 0), max(top, 0), min(right, size[0]), min(bottom, size[1])
+
+    def _array_shape(self) -> tuple[int, ...]:
+        left, top, right, bottom = self._array_window()
+        blank = self._decode_value(np.zeros((1, 1, 4), dtype=np.uint8))
+        return (bottom - top, right - left) + blank.shape[2:]
+
+    def merge_array(self, out: np.ndarray = None) -> np.ndarray:
+        """
+        Decode tiles straight into a numeric array, skipping PNG encoding.
+
+        With ``crop`` the array covers the requested bounds at native
+        resolution. ``out`` may be a preallocated array or memmap.
+        """
+        left, top, right, bottom = self._array_window()
+        blank = self._decode_value(np.zeros((1, 1, 4), dtype=np.uint8))
+        self.reduce = 1
+        if out is None:
+            out = np.empty(self._array_shape(), dtype=blank.dtype)
+        out[:] = blank[0, 0]
+
+        for tile, tile_img in self._iter_tile_images(self.tiles):
+            ox = (tile.tile.x - self.start_x) * self.tilesize
+            oy = (tile.tile.y - self.start_y) * self.tilesize
+            data = np.asarray(tile_img.convert("RGBA"))
+            x0, x1 = max(ox, left), min(ox + data.shape[1], right)
+            y0, y1 = max(oy, top), min(oy + data.shape[0], bottom)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            out[y0 - top : y1 - top, x0 - left : x1 - left] = self._decode_value(
+                data[y0 - oy : y1 - oy, x0 - ox : x1 - ox]
+            )
+        print(f"blank tiles: {self.blank_count} deduplicated: {self.dedup_count}")
+
+        self._update_meta()
+        return out
+
+    def to_array(self, tmp_dir: str = None, resume: bool = False) -> np.ndarray:
+        if tmp_dir is None and resume:
+            # no output name to derive a work dir from
+            raise ValueError("resume requires tmp_dir")
         if tmp_dir is None:
             with tempfile.TemporaryDirectory() as tmp_dir:
-                self.download(tmp_dir)
-                return self.merge(output)
+                return self.to_array(tmp_dir)
+        self.download(tmp_dir, resume=resume)
+        return self.merge_array()
+
+    def to_npy(
+        self,
+        output: str,
+        tmp_dir: str = None,
+        resume: bool = False,
+        mmap: bool = False,
+    ) -> str:
+        """
+        Write decoded values to ``output`` (.npy) with georeferencing in a
+        ``.json`` sidecar. ``mmap`` writes tiles straight into a memory-mapped
+        file, for mosaics larger than RAM.
+        """
+        if tmp_dir is None and resume:
+            tmp_dir = f"{output}.tiles"
+        if tmp_dir is None:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                return self.to_npy(output, tmp_dir, mmap=mmap)
+        self.download(tmp_dir, resume=resume)
+
+        if mmap:
+            blank = self._decode_value(np.zeros((1, 1, 4), dtype=np.uint8))
+            out = np.lib.format.open_memmap(
+                output, mode="w+", dtype=blank.dtype, shape=self._array_shape()
+            )
+            self.merge_array(out)
+            out.flush()
         else:
-            self.download(tmp_dir)
-            return self.merge(output)
+            out = self.merge_array()
+            np.save(output, out)
+
+        meta = dict(self.meta_info, shape=list(out.shape), dtype=str(out.dtype))
+        with Path(output).with_suffix(".json").open("w") as f:
+            json.dump(meta, f)
+        print(output)
+        return output
+
+    def to_png(
+        self, output: str, tmp_dir: str = None, workers: int = 1, resume: bool = False
+    ) -> str | None:
+        if tmp_dir is None and resume:
+            # resuming needs a work dir that outlives the run
+            tmp_dir = f"{output}.tiles"
+        if tmp_dir is None:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                return self.to_png(output, tmp_dir, workers)
+        if workers > 1:
+            return self.merge(output, run_sharded(self, tmp_dir, workers, resume))
+        self.download(tmp_dir, resume=resume)
+        return self.merge(output)
 
     def _crop(
         self, image: Image.Image, my_bounds: list[float], mx_bounds: list[float]
@@ -228,7 +491,7 @@ class TileDownloader(object):
             my_bounds,
             mx_bounds,
         )
-        return img.resize((670, 670))
+        return img.resize(self.crop_size)
 
 
 class WindyTileDownloader(TileDownloader):
@@ -241,3 +504,9 @@ class WindyTileDownloader(TileDownloader):
         )
         print(self.url_template)
         super().__init__(*args, **kwargs)
+
+
+class TemplateTileDownloader(TileDownloader):
+    def __init__(self, url_template: str, *args, **kwargs):
+        self.url_template = url_template
+        super().__init__(*args, **kwargs)
@@ -0,0 +1,80 @@
+import hashlib
+import json
+from pathlib import Path
+
+__all__ = ["TileManifest"]
+
+
+class TileManifest(object):
+    """
+    Append-only journal of completed tiles in a work dir.
+
+    One JSON line per tile: url, z/x/y, file, size, sha256 and a blank flag.
+    Blank tiles are a sentinel entry whose file is never written. Later
+    lines win, and a truncated last line from a killed run is ignored and
+    terminated on load so new entries are not glued onto it.
+    """
+
+    filename = "manifest.jsonl"
+
+    def __init__(self, folder):
+        self.path = Path(folder) / self.filename
+        self.entries: dict[str, dict] = {}
+        self.load()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.entries[entry["url"]] = entry
+        # end a truncated last line so the next append starts on its own line
+        with self.path.open("rb+") as f:
+            if f.seek(0, 2) == 0:
+                return
+            f.seek(-1, 2)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    def is_valid(self, t) -> bool:
+        entry = self.entries.get(t.url)
+        if entry is None:
+            return False
+        if entry.get("blank"):
+            return True
+        file = Path(entry["file"])
+        if not file.exists() or file.stat().st_size != entry["size"]:
+            return False
+        return hashlib.sha256(file.read_bytes()).hexdigest() == entry["sha256"]
+
+    def blank_hashes(self) -> set[str]:
+        return {e["sha256"] for e in self.entries.values() if e.get("blank")}
+
+    def record(self, t, content: bytes):
+        entry = {
+            "url": t.url,
+            "z": t.tile.zoom,
+            "x": t.tile.x,
+            "y": t.tile.y,
+            "file": str(t.file),
+            "size": len(content),
+            "sha256": t.sha256 or hashlib.sha256(content).hexdigest(),
+            "blank": t.blank,
+        }
+        self.entries[t.url] = entry
+        # single write per line so appends from shard workers don't interleave
+        with self.path.open("a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def mark_blank(self, t):
+        """Flag an already recorded tile as blank for later runs."""
+        if t.url not in self.entries or self.entries[t.url].get("blank"):
+            return
+        entry = dict(self.entries[t.url], blank=True)
+        self.entries[t.url] = entry
+        with self.path.open("a") as f:
+            f.write(json.dumps(entry) + "\n")
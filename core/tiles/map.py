@@ -5,6 +5,7 @@ __all__ = ["GoogleSatelliteMapTileDownloader"]
 
 class GoogleSatelliteMapTileDownloader(TileDownloader):
     url_template = "https://mt0.google.com/vt/lyrs=s{style}&x={x}&y={y}&z={z}"
+    max_zoom = 20
 
     def __init__(self, style: dict, *args, **kwargs):
         self.style = style
@@ -12,6 +12,7 @@ __all__ = ["RainViewerRadarV2TileDownloader", "WindyRadarV2TileDownloader"]
 class RainViewerRadarV2TileDownloader(TileDownloader):
     url_template = "https://cdn.rainviewer.com/v2/radar/{timestamp}/{tilesize}/{z}/{x}/{y}/255/0_0.webp"
     tilesize = 256
+    max_zoom = 7
 
     def __init__(self, timestamp: int, *args, **kwargs):
         self.timestamp = timestamp
@@ -21,15 +22,17 @@ class RainViewerRadarV2TileDownloader(TileDownloader):
         print(self.url_template)
         super().__init__(*args, **kwargs)
 
-    def _parse_value(self, merged_pic: Image.Image) -> Image.Image:
-        # return merged_pic
-
-        data = np.array(merged_pic, dtype=np.float32)
-
-        map = data[:, :, 0]
+    def _decode_value(self, data: np.ndarray) -> np.ndarray:
+        map = data[..., 0].astype(np.float32)
         map[map >= 128] -= 128
         map[map <= 32] = 0
         map[map >= 32] -= 32
+        return map
+
+    def _parse_value(self, merged_pic: Image.Image) -> Image.Image:
+        # return merged_pic
+
+        map = self._decode_value(np.asarray(merged_pic))
         # logger.info("rainviewer min: {}, max: {}, mean: {}".format(np.min(map), np.max(map), np.mean(map)))
 
         # cy color
@@ -40,13 +40,16 @@ class WindySatelliteTileDownloader(WindyTileDownloader):
     def _parse_value(self, merged_pic: Image.Image) -> Image.Image:
         return merged_pic
 
+    def _decode_value(self, data: np.ndarray) -> np.ndarray:
+        return data[..., 0].astype(np.float32) / 255.0
+
 
 class WindySatelliteInfraTileDownloader(WindySatelliteTileDownloader):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     def _process_single_tile(self, tile: TileFile) -> Image.Image:
-        img = Image.open(tile.file)
+        img = self._open_tile(tile)
         data = np.array(img, dtype=np.float32) / 255.0
         _, ir01 = undither_visir_mosaic(data)
         return Image.fromarray((ir01 * 255).astype(np.uint8))
@@ -57,7 +60,7 @@ class WindySatelliteVisTileDownloader(WindySatelliteTileDownloader):
         super().__init__(*args, **kwargs)
 
     def _process_single_tile(self, tile: TileFile) -> Image.Image:
-        img = Image.open(tile.file)
+        img = self._open_tile(tile)
         data = np.array(img, dtype=np.float32) / 255.0
         vis01, _ = undither_visir_mosaic(data)
         return Image.fromarray((vis01 * 255).astype(np.uint8))
@@ -65,6 +68,7 @@ class WindySatelliteVisTileDownloader(WindySatelliteTileDownloader):
 
 class RainviewSatelliteInfraTileDownloader(TileDownloader):
     api_url = "https://api.rainviewer.com/public/weather-maps.json"
+    max_zoom = 7
 
     def __init__(self, date: arrow.Arrow, *args, **kwargs):
         self.timestamp = int(date.timestamp() / 600) * 600
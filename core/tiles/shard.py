@@ -0,0 +1,125 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+from PIL import Image
+
+from .manifest import TileManifest
+
+__all__ = ["run_sharded", "split_blocks"]
+
+# block side length in tiles, 16 tiles -> 4096x4096 px per worker canvas
+shard_size = 16
+
+_downloader = None
+
+
+def split_blocks(
+    start_x: int, start_y: int, end_x: int, end_y: int, size: int = shard_size
+) -> list[tuple[int, int, int, int]]:
+    """Split an inclusive tile range into rectangular (x0, y0, x1, y1) blocks."""
+    return [
+        (x0, y0, min(x0 + size - 1, end_x), min(y0 + size - 1, end_y))
+        for x0, y0 in product(
+            range(start_x, end_x + 1, size), range(start_y, end_y + 1, size)
+        )
+    ]
+
+
+def _init_worker(downloader, folder: str):
+    global _downloader
+    _downloader = downloader
+    # read the journal once per worker, download() reuses it for every block
+    _downloader.manifest = TileManifest(folder)
+
+
+def _run_block(
+    block, indices: list[int], folder: str, canvas_path: str, resume: bool
+) -> dict:
+    d = _downloader
+    x0, y0, x1, y1 = block
+    tiles = [d.tiles[i] for i in indices]
+
+    start = time.perf_counter()
+    d.success_count = 0
+    d.download(folder, tiles=tiles, resume=resume)
+    part = d._paste_tiles(tiles, x0, y0, x1 - x0 + 1, y1 - y0 + 1)
+
+    canvas = np.load(canvas_path, mmap_mode="r+")
+    px, py = (x0 - d.start_x) * d.tile_px, (y0 - d.start_y) * d.tile_px
+    canvas[py : py + part.height, px : px + part.width] = np.asarray(part)
+    canvas.flush()
+    return {
+        "pid": os.getpid(),
+        "tiles": len(tiles),
+        "success": d.success_count,
+        "blank": d.blank_count,
+        "dedup": d.dedup_count,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def run_sharded(
+    downloader,
+    folder: str,
+    workers: int,
+    resume: bool = False,
+    size: int = shard_size,
+) -> Image.Image:
+    """
+    Download and paste the tile range of ``downloader`` in worker processes.
+
+    Each worker owns a client and a partial canvas per block and writes it
+    into a shared ``.npy`` memmap, so pixels never travel through pickles.
+    """
+    os.makedirs(folder, exist_ok=True)
+    d = downloader
+    blocks = split_blocks(d.start_x, d.start_y, d.end_x, d.end_y, size)
+    # bucket tile indices by block in one pass over the tiles
+    block_tiles: dict[tuple[int, int], list[int]] = {}
+    for i, t in enumerate(d.tiles):
+        key = ((t.tile.x - d.start_x) // size, (t.tile.y - d.start_y) // size)
+        block_tiles.setdefault(key, []).append(i)
+    canvas_path = os.path.join(folder, "canvas.npy")
+    d.reduce = d._decode_reduce()
+    shape = (d.len_y * d.tile_px, d.len_x * d.tile_px, 4)
+    np.lib.format.open_memmap(canvas_path, mode="w+", dtype=np.uint8, shape=shape)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(d, folder)
+    ) as executor:
+        futures = []
+        for block in blocks:
+            key = ((block[0] - d.start_x) // size, (block[1] - d.start_y) // size)
+            indices = block_tiles.get(key)
+            if not indices:
+                # e.g. blocks outside an aoi
+                continue
+            futures.append(
+                executor.submit(_run_block, block, indices, folder, canvas_path, resume)
+            )
+        results = [f.result() for f in futures]
+
+    stats: dict[int, dict] = {}
+    for r in results:
+        s = stats.setdefault(r["pid"], {"blocks": 0, "tiles": 0, "seconds": 0.0})
+        s["blocks"] += 1
+        s["tiles"] += r["tiles"]
+        s["seconds"] += r["seconds"]
+    for pid, s in stats.items():
+        rate = s["tiles"] / s["seconds"] if s["seconds"] else 0.0
+        print(
+            f"worker {pid}: blocks: {s['blocks']} tiles: {s['tiles']} "
+            f"{rate:.1f} tiles/s"
+        )
+    d.success_count = sum(r["success"] for r in results)
+    d.blank_count = sum(r["blank"] for r in results)
+    d.dedup_count = sum(r["dedup"] for r in results)
+    print(f"success_count: {d.success_count} total: {len(d.tiles)}")
+
+    # the merged image owns its pixels, the full-size canvas file can go
+    canvas = np.load(canvas_path)
+    os.remove(canvas_path)
+    return Image.fromarray(canvas)
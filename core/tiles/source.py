@@ -0,0 +1,205 @@
+import asyncio
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+import httpx
+
+from ..config import header
+
+__all__ = [
+    "HttpTileSource",
+    "LocalTileSource",
+    "MBTilesTileSource",
+    "TileSource",
+    "source_for_template",
+]
+
+max_concurrency = 10
+
+
+class TileSource(object):
+    """
+    Where tile payloads come from.
+
+    ``fetch`` calls ``store(t, content)`` for every tile it can read, or
+    ``store(t, content, path)`` when the payload already lives in a local
+    file, and sets ``t.file = None`` for tiles it could not get.
+    """
+
+    # image format of the tiles if the source knows it, e.g. from metadata
+    format = None
+
+    def url_template(self, url_template: str) -> str:
+        return url_template
+
+    def fetch(self, tiles: list, store) -> None:
+        raise NotImplementedError("Not implemented")
+
+
+class HttpTileSource(TileSource):
+    def __init__(
+        self,
+        headers: dict = header,
+        timeout: float = 20,
+        max_retries: int = 3,
+        retry_delay: float = 1,
+        concurrency: int = max_concurrency,
+    ):
+        self.headers = headers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.concurrency = concurrency
+
+    def fetch(self, tiles: list, store) -> None:
+        asyncio.run(self._download_tiles_httpx(tiles, store))
+
+    async def _download_tiles_httpx(self, tiles: list, store):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with httpx.AsyncClient() as client:
+            tasks = [self._request_httpx(semaphore, client, t, store) for t in tiles]
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return tiles
+
+    async def _request_httpx(
+        self, semaphore: asyncio.Semaphore, client: httpx.AsyncClient, t, store
+    ):
+        attempt = 0
+        while attempt < self.max_retries:
+            async with semaphore:
+                try:
+                    response = await client.get(
+                        t.url, headers=self.headers, timeout=self.timeout
+                    )
+                    response.raise_for_status()
+                    store(t, response.content)
+                    return t
+                except (
+                    httpx.HTTPStatusError,
+                    httpx.ConnectTimeout,
+                    httpx.ReadTimeout,
+                    httpx.ReadError,
+                ):
+                    attempt += 1
+                    await asyncio.sleep(self.retry_delay)
+        t.file = None
+        return t
+
+
+class LocalTileSource(TileSource):
+    """
+    ``{z}/{x}/{y}.ext`` trees on disk, as a plain path or ``file://`` template.
+
+    Paths are built from the tile z/x/y, so a provider can keep its own url
+    template (and manifest keys) and read a local mirror instead. Files are
+    read in a thread pool and used in place, without a copy into the work dir.
+    """
+
+    def __init__(self, url_template: str, concurrency: int = 32):
+        self.template = url_template
+        self.concurrency = concurrency
+        suffix = re.match(r"\.(png|webp|jpg)?", Path(url_template).suffix)
+        if suffix is not None and suffix.group(1):
+            self.format = suffix.group(1)
+
+    @staticmethod
+    def _path(url: str) -> Path:
+        if url.startswith("file://"):
+            return Path(unquote(urlparse(url).path))
+        return Path(url)
+
+    def tile_path(self, t) -> Path:
+        return self._path(self.template.format(z=t.tile.zoom, x=t.tile.x, y=t.tile.y))
+
+    @staticmethod
+    def _read(path: Path) -> tuple[Path, bytes | None]:
+        try:
+            return path, path.read_bytes()
+        except OSError:
+            return path, None
+
+    def fetch(self, tiles: list, store) -> None:
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            results = executor.map(self._read, [self.tile_path(t) for t in tiles])
+            for t, (path, content) in zip(tiles, results):
+                if content is None:
+                    t.file = None
+                else:
+                    store(t, content, path)
+
+
+class MBTilesTileSource(TileSource):
+    """
+    MBTiles SQLite file, read with one ranged SELECT per run of contiguous
+    rows in a column, so sparse requests only read the tiles they need.
+
+    Rows are in TMS order, so y is flipped against the XYZ tiles.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT value FROM metadata WHERE name = 'format'"
+            ).fetchone()
+        if row is not None:
+            self.format = {"jpeg": "jpg"}.get(row[0], row[0])
+
+    def _connect(self) -> sqlite3.Connection:
+        # as_uri() quotes spaces, "?" and "#" in the path
+        return sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+
+    def url_template(self, url_template: str) -> str:
+        # one url per tile, so the manifest and batch pools can key on it
+        if "{z}" not in url_template:
+            url_template = url_template.rstrip("/") + "/{z}/{x}/{y}"
+        return url_template
+
+    @staticmethod
+    def _runs(wanted) -> list[list[int]]:
+        """(x, y0, y1) runs of contiguous rows per column, in index order."""
+        runs = []
+        for x, y in sorted(wanted):
+            if runs and runs[-1][0] == x and runs[-1][2] == y - 1:
+                runs[-1][2] = y
+            else:
+                runs.append([x, y, y])
+        return runs
+
+    def fetch(self, tiles: list, store) -> None:
+        by_zoom: dict[int, dict[tuple[int, int], object]] = {}
+        for t in tiles:
+            tms_y = (1 << t.tile.zoom) - 1 - t.tile.y
+            by_zoom.setdefault(t.tile.zoom, {})[(t.tile.x, tms_y)] = t
+
+        found = set()
+        with closing(self._connect()) as conn:
+            for zoom, wanted in by_zoom.items():
+                for x, y0, y1 in self._runs(wanted):
+                    rows = conn.execute(
+                        "SELECT tile_row, tile_data FROM tiles "
+                        "WHERE zoom_level = ? AND tile_column = ? "
+                        "AND tile_row BETWEEN ? AND ?",
+                        (zoom, x, y0, y1),
+                    )
+                    for y, data in rows:
+                        t = wanted[(x, y)]
+                        store(t, bytes(data))
+                        found.add(id(t))
+        for t in tiles:
+            if id(t) not in found:
+                t.file = None
+
+
+def source_for_template(url_template: str) -> TileSource:
+    """HTTP for http(s) templates, MBTiles for .mbtiles, local files otherwise."""
+    if url_template.startswith(("http://", "https://")):
+        return HttpTileSource()
+    if ".mbtiles" in url_template:
+        path = url_template[: url_template.index(".mbtiles") + len(".mbtiles")]
+        return MBTilesTileSource(LocalTileSource._path(path))
+    return LocalTileSource(url_template)
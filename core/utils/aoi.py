@@ -0,0 +1,248 @@
+import json
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .proj import get_latlng, get_mymx, w2m
+
+__all__ = ["CircleAOI", "PolygonAOI", "load_aoi"]
+
+
+class AOI(object):
+    """
+    Area of interest in EPSG:3857 meters.
+
+    Boxes are passed as (my_bounds, mx_bounds), i.e. [bottom, top] and
+    [left, right], the same convention as TileDownloader bounds.
+    """
+
+    def bounds(self) -> tuple[list[float], list[float]]:
+        """Lat/lng bounds of the AOI as (lat_bounds, lon_bounds)."""
+        my_min, my_max, mx_min, mx_max = self._extent()
+        lat_min, lon_min = get_latlng(my_min, mx_min)
+        lat_max, lon_max = get_latlng(my_max, mx_max)
+        return [lat_min, lat_max], [lon_min, lon_max]
+
+    def _extent(self) -> tuple[float, float, float, float]:
+        raise NotImplementedError("Not implemented")
+
+    def tile_grid(
+        self, tile_xy, start_x: int, start_y: int, end_x: int, end_y: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (intersects, contains) for every tile of the inclusive range, as
+        boolean arrays indexed [y - start_y, x - start_x].
+        """
+        raise NotImplementedError("Not implemented")
+
+    def mask(
+        self, size: tuple[int, int], my_bounds: list[float], mx_bounds: list[float]
+    ) -> Image.Image:
+        """Mode "L" mask of an image covering the box, 255 inside the AOI."""
+        raise NotImplementedError("Not implemented")
+
+
+class CircleAOI(AOI):
+    def __init__(self, center_latlng: tuple[float, float], radius: float):
+        self.center_my, self.center_mx = get_mymx(*center_latlng)
+        self.radius = radius
+
+    def _extent(self):
+        r = self.radius
+        return (
+            self.center_my - r,
+            self.center_my + r,
+            self.center_mx - r,
+            self.center_mx + r,
+        )
+
+    def intersects(self, my_bounds, mx_bounds) -> bool:
+        # distance from the center to the nearest point of the box
+        dy = self.center_my - min(max(self.center_my, my_bounds[0]), my_bounds[1])
+        dx = self.center_mx - min(max(self.center_mx, mx_bounds[0]), mx_bounds[1])
+        return math.hypot(dx, dy) <= self.radius
+
+    def contains(self, my_bounds, mx_bounds) -> bool:
+        dy = max(abs(my_bounds[0] - self.center_my), abs(my_bounds[1] - self.center_my))
+        dx = max(abs(mx_bounds[0] - self.center_mx), abs(mx_bounds[1] - self.center_mx))
+        return math.hypot(dx, dy) <= self.radius
+
+    def tile_grid(self, tile_xy, start_x, start_y, end_x, end_y):
+        shape = (end_y - start_y + 1, end_x - start_x + 1)
+        intersects = np.zeros(shape, dtype=bool)
+        contains = np.zeros(shape, dtype=bool)
+        for y in range(start_y, end_y + 1):
+            for x in range(start_x, end_x + 1):
+                bounds = tile_xy.get_tile_mercator_bounds(x, y)
+                intersects[y - start_y, x - start_x] = self.intersects(*bounds)
+                contains[y - start_y, x - start_x] = self.contains(*bounds)
+        return intersects, contains
+
+    def mask(self, size, my_bounds, mx_bounds):
+        w, h = size
+        sx = w / (mx_bounds[1] - mx_bounds[0])
+        sy = h / (my_bounds[1] - my_bounds[0])
+        left = (self.center_mx - self.radius - mx_bounds[0]) * sx
+        right = (self.center_mx + self.radius - mx_bounds[0]) * sx
+        top = (my_bounds[1] - self.center_my - self.radius) * sy
+        bottom = (my_bounds[1] - self.center_my + self.radius) * sy
+        mask = Image.new("L", size, 0)
+        ImageDraw.Draw(mask).ellipse((left, top, right, bottom), fill=255)
+        return mask
+
+
+class PolygonAOI(AOI):
+    """
+    GeoJSON Polygon/MultiPolygon AOI, holes included.
+
+    Each polygon keeps its rings as mercator (mx, my) arrays and all of its
+    edges stacked as (x0, y0, x1, y1) rows. Tile grids and masks are both
+    rasterized with an even-odd scanline over the edges.
+    """
+
+    def __init__(self, polygons: list[list[list[tuple[float, float]]]]):
+        self.polygons = []
+        for rings in polygons:
+            rings = [self._project(ring) for ring in rings]
+            edges = np.concatenate([np.hstack([ring[:-1], ring[1:]]) for ring in rings])
+            self.polygons.append((rings, edges))
+
+    @staticmethod
+    def _project(ring: list[tuple[float, float]]) -> np.ndarray:
+        lng, lat = np.asarray(ring, dtype=np.float64)[:, :2].T
+        mx, my = w2m.transform(lng, lat)
+        ring = np.column_stack([mx, my])
+        if not np.array_equal(ring[0], ring[-1]):
+            ring = np.vstack([ring, ring[:1]])
+        return ring
+
+    @classmethod
+    def from_geojson(cls, data: dict) -> "PolygonAOI":
+        """Build from a Feature, FeatureCollection or (Multi)Polygon geometry."""
+        if data["type"] == "FeatureCollection":
+            geometries = [f["geometry"] for f in data["features"]]
+        elif data["type"] == "Feature":
+            geometries = [data["geometry"]]
+        else:
+            geometries = [data]
+
+        polygons = []
+        for geometry in geometries:
+            if geometry["type"] == "Polygon":
+                polygons.append(geometry["coordinates"])
+            elif geometry["type"] == "MultiPolygon":
+                polygons.extend(geometry["coordinates"])
+            else:
+                raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+        return cls(polygons)
+
+    @classmethod
+    def from_file(cls, path: str) -> "PolygonAOI":
+        with open(path) as f:
+            return cls.from_geojson(json.load(f))
+
+    def _extent(self):
+        points = np.vstack([rings[0] for rings, _ in self.polygons])
+        (mx_min, my_min), (mx_max, my_max) = points.min(axis=0), points.max(axis=0)
+        return my_min, my_max, mx_min, mx_max
+
+    @staticmethod
+    def _to_px(edges: np.ndarray, size, my_bounds, mx_bounds) -> np.ndarray:
+        """Edges as (u0, v0, u1, v1) pixel coordinates of an image over the box."""
+        w, h = size
+        sx = w / (mx_bounds[1] - mx_bounds[0])
+        sy = h / (my_bounds[1] - my_bounds[0])
+        u = (edges[:, [0, 2]] - mx_bounds[0]) * sx
+        v = (my_bounds[1] - edges[:, [1, 3]]) * sy
+        return np.column_stack([u[:, 0], v[:, 0], u[:, 1], v[:, 1]])
+
+    @staticmethod
+    def _even_odd(px: np.ndarray, w: int, h: int) -> np.ndarray:
+        """Pixel centers inside the edges, scanning one row of pixels at a time."""
+        u0, v0, u1, v1 = px.T
+        # only edges across the rows and not fully left of the image matter
+        band = (np.maximum(v0, v1) > 0) & (np.minimum(v0, v1) < h) & (v0 != v1)
+        band &= np.maximum(u0, u1) >= 0
+        u0, v0, u1, v1 = u0[band], v0[band], u1[band], v1[band]
+
+        # count edge crossings right of each pixel center per row
+        hist = np.zeros((h, w + 2), dtype=np.int32)
+        for row in range(h):
+            vc = row + 0.5
+            hit = (v0 > vc) != (v1 > vc)
+            x = u0[hit] + (vc - v0[hit]) * (u1[hit] - u0[hit]) / (v1[hit] - v0[hit])
+            k = np.clip(np.ceil(x - 0.5), 0, w + 1).astype(np.int64)
+            hist[row] = np.bincount(k, minlength=w + 2)
+        counts = hist.sum(axis=1, keepdims=True) - np.cumsum(hist, axis=1)[:, :w]
+        return counts % 2 == 1
+
+    @staticmethod
+    def _crossed(px: np.ndarray, w: int, h: int) -> np.ndarray:
+        """Pixels (grid cells) that any edge passes through or touches."""
+        u0, v0, u1, v1 = px.T
+        du, dv = u1 - u0, v1 - v0
+        vmin, vmax = np.minimum(v0, v1), np.maximum(v0, v1)
+        crossed = np.zeros((h, w), dtype=bool)
+        for row in range(h):
+            sel = (vmax >= row) & (vmin <= row + 1)
+            if not sel.any():
+                continue
+            # part of each edge inside the row band, as a parameter range
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ta = (row - v0[sel]) / dv[sel]
+                tb = (row + 1 - v0[sel]) / dv[sel]
+            flat = dv[sel] == 0
+            t_lo = np.where(flat, 0, np.clip(np.minimum(ta, tb), 0, 1))
+            t_hi = np.where(flat, 1, np.clip(np.maximum(ta, tb), 0, 1))
+            ua = u0[sel] + t_lo * du[sel]
+            ub = u0[sel] + t_hi * du[sel]
+            x_lo = np.floor(np.minimum(ua, ub))
+            x_hi = np.floor(np.maximum(ua, ub))
+            keep = (x_hi >= 0) & (x_lo <= w - 1)
+            x_lo = np.clip(x_lo[keep], 0, w - 1).astype(np.int64)
+            x_hi = np.clip(x_hi[keep], 0, w - 1).astype(np.int64)
+            diff = np.bincount(x_lo, minlength=w + 1) - np.bincount(
+                x_hi + 1, minlength=w + 1
+            )
+            crossed[row] = np.cumsum(diff)[:w] > 0
+        return crossed
+
+    def _inside_px(self, size, my_bounds, mx_bounds) -> np.ndarray:
+        w, h = size
+        inside = np.zeros((h, w), dtype=bool)
+        for _, edges in self.polygons:
+            px = self._to_px(edges, size, my_bounds, mx_bounds)
+            inside |= self._even_odd(px, w, h)
+        return inside
+
+    def mask(self, size, my_bounds, mx_bounds) -> Image.Image:
+        inside = self._inside_px(size, my_bounds, mx_bounds)
+        return Image.fromarray(inside.astype(np.uint8) * 255)
+
+    def tile_grid(self, tile_xy, start_x, start_y, end_x, end_y):
+        # the tile grid is an image with one pixel per tile
+        size = (end_x - start_x + 1, end_y - start_y + 1)
+        (_, top), (left, _) = tile_xy.get_tile_mercator_bounds(start_x, start_y)
+        (bottom, _), (_, right) = tile_xy.get_tile_mercator_bounds(end_x, end_y)
+        my_bounds, mx_bounds = [bottom, top], [left, right]
+
+        inside = self._inside_px(size, my_bounds, mx_bounds)
+        crossed = np.zeros_like(inside)
+        for _, edges in self.polygons:
+            px = self._to_px(edges, size, my_bounds, mx_bounds)
+            crossed |= self._crossed(px, *size)
+        return inside | crossed, inside & ~crossed
+
+
+def load_aoi(
+    aoi: str, center_latlng: tuple[float, float] = None, radius: float = 0
+) -> AOI | None:
+    """ "circle" for center_latlng + radius, otherwise a GeoJSON file path."""
+    if aoi is None:
+        return None
+    if aoi == "circle":
+        if not center_latlng:
+            raise ValueError("circle aoi requires center_latlng")
+        return CircleAOI(center_latlng, radius)
+    return PolygonAOI.from_file(aoi)
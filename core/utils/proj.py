@@ -15,14 +15,14 @@ def get_latlng(my, mx):
     return lat, lon
 
 
-def crop_image(
-    img: Image.Image,
+def crop_box(
+    size: tuple[int, int],
     img_my_bounds: list[float],
     img_mx_bounds: list[float],
     crop_my_bounds: list[float],
     crop_mx_bounds: list[float],
-) -> Image.Image | None:
-    w, h = img.size
+) -> tuple[int, int, int, int] | None:
+    w, h = size
     img_mx_resolution = w / (img_mx_bounds[1] - img_mx_bounds[0])
     img_my_resolution = h / (img_my_bounds[1] - img_my_bounds[0])
 
@@ -43,7 +43,20 @@ def crop_image(
     crop_px_lr = int((crop_mx_bounds[1] - img_mx_bounds[0]) * img_mx_resolution)
     crop_py_lr = int((img_my_bounds[1] - crop_my_bounds[0]) * img_my_resolution)
 
-    # Pillow crop (左,上,右,下)
-    crop = img.crop((crop_px_ul, crop_py_ul, crop_px_lr, crop_py_lr))
+    # (左,上,右,下)
+    return crop_px_ul, crop_py_ul, crop_px_lr, crop_py_lr
 
-    return crop
+
+def crop_image(
+    img: Image.Image,
+    img_my_bounds: list[float],
+    img_mx_bounds: list[float],
+    crop_my_bounds: list[float],
+    crop_mx_bounds: list[float],
+) -> Image.Image | None:
+    box = crop_box(
+        img.size, img_my_bounds, img_mx_bounds, crop_my_bounds, crop_mx_bounds
+    )
+    if box is None:
+        return None
+    return img.crop(box)
@@ -74,12 +74,28 @@ class GoogleXYZTile:
         lon_deg = (x / self.num_tiles * 360.0) - 180.0
         return lat_deg, lon_deg
 
-    def iter_tile_xy(self, top_lat, left_lng, bottom_lat, right_lng) -> Iterator[Tile]:
-        """获取指定经纬度范围内的所有瓦片坐标"""
+    def get_tile_mercator_bounds(
+        self, x, y
+    ) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        """获取瓦片的墨卡托范围 ([bottom, top], [left, right])"""
+        size = EQUATOR_CIRCUMFERENCE / self.num_tiles
+        left = x * size - EQUATOR_CIRCUMFERENCE / 2
+        top = EQUATOR_CIRCUMFERENCE / 2 - y * size
+        return (top - size, top), (left, left + size)
+
+    def iter_tile_xy(
+        self, top_lat, left_lng, bottom_lat, right_lng, cells=None
+    ) -> Iterator[Tile]:
+        """
+        获取指定经纬度范围内的所有瓦片坐标,
+        cells 为 [y, x] 布尔网格时只保留为 True 的瓦片 (如 aoi.tile_grid)
+        """
         pos_1x, pos_1y, pos_2x, pos_2y = self.get_xy_range(
             top_lat, left_lng, bottom_lat, right_lng
         )
         for x, y in product(range(pos_1x, pos_2x + 1), range(pos_1y, pos_2y + 1)):
+            if cells is not None and not cells[y - pos_1y, x - pos_1x]:
+                continue
             yield Tile(x, y, self.zoom, Point(*self.get_tile_lat_lng(x, y)))
 
     def get_xy_range(
@@ -91,6 +107,40 @@ class GoogleXYZTile:
         return pos_1x, pos_1y, pos_2x, pos_2y
 
 
+def _mercator_y(lat) -> float:
+    return EARTH_RADIUS * math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+
+
+def select_zoom(
+    top_lat,
+    left_lng,
+    bottom_lat,
+    right_lng,
+    target_size: int = None,
+    target_resolution: float = None,
+    tilesize: int = 256,
+    min_zoom: int = 0,
+    max_zoom: int = 18,
+) -> int:
+    """
+    选择满足目标输出的最小缩放级别
+
+    target_size: pixels the shorter side of the bbox must reach
+    target_resolution: ground resolution in meters/pixel at the bbox center
+    """
+    width = (right_lng - left_lng) / 360 * EQUATOR_CIRCUMFERENCE
+    height = _mercator_y(top_lat) - _mercator_y(bottom_lat)
+    scale = math.cos(math.radians((top_lat + bottom_lat) / 2))
+    for zoom in range(min_zoom, max_zoom + 1):
+        resolution = EQUATOR_CIRCUMFERENCE / (tilesize * (1 << zoom))
+        if target_size is not None and min(width, height) / resolution < target_size:
+            continue
+        if target_resolution is not None and resolution * scale > target_resolution:
+            continue
+        return zoom
+    return max_zoom
+
+
 if __name__ == "__main__":
     zoom = 10
     tile = GoogleXYZTile(zoom=zoom)